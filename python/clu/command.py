@@ -275,7 +275,8 @@ class BaseCommand(
                 if self._timer_handler:
                     self._timer_handler.cancel()
 
-            # Set the status watcher
+            # Wake up the tasks waiting for this status.
+            self.notify_status_waiters()
             if self.watcher is not None:
                 self.watcher.set()
 
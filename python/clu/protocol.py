@@ -10,9 +10,10 @@ from __future__ import annotations
 
 import asyncio
 import random
+import socket
 from contextlib import suppress
 
-from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, TypeVar, Union
 
 import aio_pika as apika
 import aiormq
@@ -29,12 +30,101 @@ __all__ = [
     "open_connection",
     "TopicListener",
     "ReconnectingTCPClientProtocol",
+    "install_uvloop",
 ]
 
 T = TypeVar("T")
 ConnectionCallbackType = Callable[[Any], Any]
 DataReceivedCallbackType = Callable[[Any, bytes], Any]
 
+MAX_CONNECTIONS_MESSAGE = b"Max number of connections reached.\n"
+
+# Default listen() backlog for all the servers. Linux caps it to
+# net.core.somaxconn, which defaults to 4096 in recent kernels.
+DEFAULT_BACKLOG = 4096
+
+
+async def _call_for_each(callback: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+    """Calls ``callback`` for each item and returns the results.
+
+    Synchronous results are collected directly. Coroutines are awaited
+    concurrently so that slow callbacks do not delay the rest of the items.
+    As in `.TCPStreamServer`, returned futures are not awaited.
+
+    """
+
+    results = [callback(item) for item in items]
+
+    pending = [ii for ii, result in enumerate(results) if asyncio.iscoroutine(result)]
+    if len(pending) == 1:
+        # No need to schedule a task if there is only one awaitable.
+        results[pending[0]] = await results[pending[0]]
+    elif len(pending) > 1:
+        values = await asyncio.gather(*[results[ii] for ii in pending])
+        for ii, value in zip(pending, values):
+            results[ii] = value
+
+    return results
+
+
+async def _sleep_until_next(deadline: float, period: float) -> float:
+    """Sleeps until ``deadline + period`` and returns the new deadline.
+
+    Using a deadline instead of sleeping ``period`` after each iteration
+    prevents the time spent in the callbacks from accumulating as drift. If
+    the iteration took longer than ``period``, the next one starts immediately
+    and the deadline is reset to the current time.
+
+    """
+
+    loop = asyncio.get_running_loop()
+
+    deadline = max(deadline + period, loop.time())
+    await asyncio.sleep(deadline - loop.time())
+
+    return deadline
+
+
+def _set_keepalive(transport: asyncio.BaseTransport):
+    """Enables ``SO_KEEPALIVE`` on the socket of a transport, if any.
+
+    This allows the server to detect and release dead idle connections.
+    ``TCP_NODELAY`` does not need to be set since asyncio already sets it
+    for all TCP transports.
+
+    """
+
+    sock = transport.get_extra_info("socket")
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        with suppress(OSError):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+def install_uvloop() -> bool:
+    """Sets `uvloop <https://github.com/MagicStack/uvloop>`__ as the event loop policy.
+
+    This function must be called before the event loop is created (e.g., before
+    `asyncio.run`). All the servers and clients in this module will then use the
+    ``uvloop`` implementation of the event loop, which provides faster socket
+    operations. ``uvloop`` can be installed with ``pip install sdss-clu[uvloop]``.
+
+    Returns
+    -------
+    installed
+        `True` if ``uvloop`` was installed as the event loop policy, `False` if
+        ``uvloop`` is not available.
+
+    """
+
+    try:
+        import uvloop
+    except ImportError:
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    return True
+
 
 class TCPProtocol(asyncio.Protocol):
     """A TCP server/client based on asyncio protocols.
@@ -54,34 +144,55 @@ class TCPProtocol(asyncio.Protocol):
     max_connections
         How many clients the server accepts. If `None`, unlimited connections
         are allowed.
+    decode
+        If `True`, the received data is decoded to a string before being
+        passed to ``data_received_callback``. Otherwise the raw `bytes` are
+        passed, which avoids a copy for callbacks that handle binary data.
     """
 
     def __init__(
         self,
         loop: asyncio.AbstractEventLoop | None = None,
         connection_callback: Optional[ConnectionCallbackType] = None,
-        data_received_callback: Optional[Callable[[str], Any]] = None,
+        data_received_callback: Optional[Callable[[str | bytes], Any]] = None,
         max_connections: Optional[int] = None,
+        decode: bool = True,
     ):
         self.connection_callback = connection_callback
         self.data_received_callback = data_received_callback
+        self.decode = decode
 
         self.transports = []
         self.max_connections = max_connections
 
-        self.loop = loop or asyncio.get_event_loop()
+        # Resolved in connection_made() to avoid get_event_loop() outside a loop.
+        self.loop = loop
 
     @classmethod
-    async def create_server(cls, host: str, port: int, **kwargs):
-        """Returns a `~asyncio.Server` connection."""
+    async def create_server(
+        cls,
+        host: str,
+        port: int,
+        backlog: int = DEFAULT_BACKLOG,
+        **kwargs,
+    ):
+        """Returns a `~asyncio.Server` connection.
 
-        loop = kwargs.get("loop", asyncio.get_event_loop())
+        ``backlog`` is the maximum number of queued connections. Other keyword
+        arguments are passed to the protocol class.
 
-        new_tcp = cls(**kwargs)
+        """
 
-        server = await loop.create_server(lambda: new_tcp, host, port)
+        loop = kwargs.get("loop", None) or asyncio.get_running_loop()
 
-        await server.start_serving()
+        new_tcp = cls(**kwargs)
+
+        server = await loop.create_server(
+            lambda: new_tcp,
+            host,
+            port,
+            backlog=backlog,
+        )
 
         return server
 
@@ -92,9 +203,9 @@ class TCPProtocol(asyncio.Protocol):
         if "connection_callback" in kwargs:
             raise KeyError("connection_callback not allowed when creating a client.")
 
-        loop = kwargs.get("loop", asyncio.get_event_loop())
+        loop = kwargs.get("loop", None) or asyncio.get_running_loop()
 
-        new_tcp = cls.__new__(cls, **kwargs)
+        new_tcp = cls(**kwargs)
         transport, protocol = await loop.create_connection(lambda: new_tcp, host, port)
 
         return transport, protocol
@@ -102,27 +213,37 @@ class TCPProtocol(asyncio.Protocol):
     def connection_made(self, transport: asyncio.Transport):
         """Receives a connection and calls the connection callback."""
 
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+
         if self.max_connections is None or (
             len(self.transports) < self.max_connections
         ):
             self.transports.append(transport)
+            _set_keepalive(transport)
         else:
-            transport.write(b"Maximum number of connections reached.")
+            transport.write(MAX_CONNECTIONS_MESSAGE)
             transport.close()
 
         if self.connection_callback:
             self.connection_callback(transport)
 
     def data_received(self, data: bytes):
-        """Decodes the received data."""
+        """Passes the received data to the callback, decoding it if needed."""
 
         if self.data_received_callback:
-            self.data_received_callback(data.decode())
+            self.data_received_callback(data.decode() if self.decode else data)
 
     def connection_lost(self, exc):
-        """Called when connection is lost."""
+        """Called when connection is lost.
+
+        Removes the closed transports from the list of transports. The same
+        protocol instance handles all the connections to the server, so we
+        cannot know which transport was lost and all are checked.
 
-        pass
+        """
+
+        self.transports = [tt for tt in self.transports if not tt.is_closing()]
 
 
 class PeriodicTCPServer(TCPProtocol):
@@ -131,11 +252,15 @@ class PeriodicTCPServer(TCPProtocol):
     Parameters
     ----------
     period_callback
-        Callback to run every iteration.
+        Callback to run every iteration. It is called for each connected
+        transport and receives the transport object. If the callback returns
+        `bytes`, they are written to the transport. It can also return a list
+        of `bytes`, which are written with `~asyncio.Transport.writelines`.
     sleep_time
         The delay between two calls to ``periodic_callback``.
     kwargs
-        Parameters to pass to `TCPProtocol`
+        Parameters to pass to `TCPProtocol`, for example ``decode=False`` to
+        receive the raw `bytes` in ``data_received_callback``.
 
     """
 
@@ -159,16 +284,26 @@ class PeriodicTCPServer(TCPProtocol):
         )
 
     @classmethod
-    async def create_server(cls, host: str, port: int, *args, **kwargs):
+    async def create_server(
+        cls,
+        host: str,
+        port: int,
+        *args,
+        backlog: int = DEFAULT_BACKLOG,
+        **kwargs,
+    ):
         """Returns a `~asyncio.Server` connection."""
 
-        loop = kwargs.get("loop", asyncio.get_event_loop())
+        loop = kwargs.get("loop", None) or asyncio.get_running_loop()
 
         new_tcp = cls(*args, **kwargs)
 
-        server = await loop.create_server(lambda: new_tcp, host, port)
-
-        await server.start_serving()
+        server = await loop.create_server(
+            lambda: new_tcp,
+            host,
+            port,
+            backlog=backlog,
+        )
 
         new_tcp.periodic_task = asyncio.create_task(new_tcp._emit_periodic())
 
@@ -187,15 +322,22 @@ class PeriodicTCPServer(TCPProtocol):
         self._periodic_callback = func
 
     async def _emit_periodic(self):
+        deadline = asyncio.get_running_loop().time()
+
         while True:
             if self.periodic_callback is not None:
-                for transport in self.transports:
-                    if asyncio.iscoroutinefunction(self.periodic_callback):
-                        await self.periodic_callback(transport)
-                    else:
-                        self.periodic_callback(transport)
+                transports = list(self.transports)
+                results = await _call_for_each(self.periodic_callback, transports)
+
+                for transport, data in zip(transports, results):
+                    if transport.is_closing():
+                        continue
+                    if isinstance(data, (bytes, bytearray)):
+                        transport.write(data)
+                    elif isinstance(data, (list, tuple)):
+                        transport.writelines(data)
 
-            await asyncio.sleep(self.sleep_time)
+            deadline = await _sleep_until_next(deadline, self.sleep_time)
 
 
 class TCPStreamServer(object):
@@ -214,12 +356,38 @@ class TCPStreamServer(object):
     connection_callback
         Callback to call when a new client connects or disconnects.
     data_received_callback
-        Callback to call when a new data is received.
+        Callback to call when a new data is received. It receives the
+        transport and the raw `bytes` read from the stream.
     loop
-        The event loop. The current event loop is used by default.
+        The event loop. If not provided, the running loop when `.start` is
+        called is used.
     max_connections
         How many clients the server accepts. If `None`, unlimited connections
         are allowed.
+    reuse_port
+        Sets the ``SO_REUSEPORT`` option on the listening socket. This allows
+        several processes to bind to the same port, in which case the kernel
+        distributes incoming connections between them. Not supported on
+        Windows.
+    backlog
+        The maximum number of queued connections passed to ``listen()``. The
+        kernel may cap this value (e.g., to ``net.core.somaxconn`` on Linux).
+    framing
+        How messages are delimited in the stream. With ``'line'`` (the default)
+        each message ends with a newline. With ``'length'`` each message is
+        preceded by its length as a 4-byte big-endian unsigned integer, and the
+        payload is read in a single call without scanning for a separator.
+    reader_limit
+        The buffer limit of the `~asyncio.StreamReader` for each connection.
+        Reading from the socket is paused when the buffer reaches twice this
+        size. It must be larger than the largest message that the server can
+        receive. This applies to both framings: clients that send a longer
+        line, or a length header larger than the limit, are disconnected.
+    write_buffer_high
+        The high-water mark of the write buffer of each connection, in bytes.
+        `~asyncio.StreamWriter.drain` only blocks once the buffer is above
+        this limit. The low-water mark is set to a quarter of this value. If
+        `None`, the asyncio defaults are used.
     """
 
     def __init__(
@@ -230,14 +398,30 @@ class TCPStreamServer(object):
         data_received_callback: Optional[DataReceivedCallbackType] = None,
         loop: Optional[asyncio.AbstractEventLoop] = None,
         max_connections: Optional[int] = None,
+        reuse_port: bool = False,
+        backlog: int = DEFAULT_BACKLOG,
+        framing: Literal["line", "length"] = "line",
+        reader_limit: int = 2**16,
+        write_buffer_high: int | None = 2**20,
     ):
         self.host = host
         self.port = port
 
         self.transports = {}
-        self.loop = loop or asyncio.get_event_loop()
+
+        # The loop is resolved when the server is started.
+        self.loop = loop
 
         self.max_connections = max_connections
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+
+        if framing not in ("line", "length"):
+            raise ValueError(f"invalid framing {framing!r}.")
+        self.framing = framing
+
+        self.reader_limit = reader_limit
+        self.write_buffer_high = write_buffer_high
 
         self.connection_callback = connection_callback
         self.data_received_callback = data_received_callback
@@ -248,10 +432,15 @@ class TCPStreamServer(object):
     async def start(self) -> asyncio.AbstractServer:
         """Starts the server and returns a `~asyncio.Server` connection."""
 
+        self.loop = self.loop or asyncio.get_running_loop()
+
         self._server = await asyncio.start_server(
             self.connection_made,
             self.host,
             self.port,
+            reuse_port=self.reuse_port,
+            backlog=self.backlog,
+            limit=self.reader_limit,
         )
 
         return self._server
@@ -273,12 +462,21 @@ class TCPStreamServer(object):
         return self._server.is_serving()
 
     async def _do_callback(self, cb, *args, **kwargs):
-        """Calls a function or coroutine callback."""
+        """Calls a function or coroutine callback.
 
-        if asyncio.iscoroutinefunction(cb):
-            return await asyncio.create_task(cb(*args, **kwargs))
-        else:
-            return cb(*args, **kwargs)
+        The callback is called and its result awaited if it is a coroutine.
+        This also handles callables that are not coroutine functions but
+        return a coroutine (e.g., objects with an ``async __call__``). Futures
+        returned by the callback (e.g., the `.Command` returned by
+        ``new_command``) are not awaited.
+
+        """
+
+        result = cb(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            return await result
+
+        return result
 
     async def connection_made(
         self,
@@ -291,34 +489,58 @@ class TCPStreamServer(object):
         callback, if any, and starts a loop to read any incoming data.
         """
 
-        if self.max_connections and len(self.transports) == self.max_connections:
-            writer.write("Max number of connections reached.\n".encode())
-            await writer.drain()
+        if self.max_connections and len(self.transports) >= self.max_connections:
+            writer.write(MAX_CONNECTIONS_MESSAGE)
+            with suppress(ConnectionResetError):
+                await writer.drain()
+            writer.close()
             return
 
         self.transports[writer.transport] = writer
+        _set_keepalive(writer.transport)
+
+        if self.write_buffer_high is not None:
+            writer.transport.set_write_buffer_limits(
+                high=self.write_buffer_high,
+                low=self.write_buffer_high // 4,
+            )
 
         if self.connection_callback:
             await self._do_callback(self.connection_callback, writer.transport)
 
-        while True:
-            try:
-                data = await reader.readuntil()
-            except (asyncio.IncompleteReadError, ConnectionResetError):
-                break
-
-            if data == b"" or reader.at_eof():
-                break
-
-            if self.data_received_callback:
-                await self._do_callback(
-                    self.data_received_callback,
-                    writer.transport,
-                    data,
-                )
-
-        self.transports.pop(writer.transport)
-        writer.close()
+        try:
+            while True:
+                try:
+                    if self.framing == "length":
+                        header = await reader.readexactly(4)
+                        length = int.from_bytes(header, "big")
+                        if length > self.reader_limit:
+                            break
+                        data = await reader.readexactly(length)
+                    else:
+                        data = await reader.readuntil()
+                        if data == b"" or reader.at_eof():
+                            break
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                    ConnectionResetError,
+                ):
+                    break
+
+                if self.data_received_callback:
+                    # Inline version of _do_callback, to avoid creating a coroutine
+                    # when the callback is synchronous. Only coroutines are awaited;
+                    # awaiting a returned Command would block the connection until
+                    # the command finishes.
+                    result = self.data_received_callback(writer.transport, data)
+                    if asyncio.iscoroutine(result):
+                        await result
+        finally:
+            # Make sure the transport is released even if the loop is
+            # cancelled or the callback raises.
+            self.transports.pop(writer.transport, None)
+            writer.close()
 
         if self.connection_callback:
             await self._do_callback(self.connection_callback, writer.transport)
@@ -395,6 +617,11 @@ class TCPStreamPeriodicServer(TCPStreamServer):
     period_callback
         Callback to run every iteration. It is called for each transport
         that is connected to the server and receives the transport object.
+        If the callback returns `bytes`, they are written to the transport.
+        It can also return a list of `bytes`, which are written in a single
+        call with `~asyncio.StreamWriter.writelines`.
+        All the writes for an iteration are issued before the transports are
+        drained, so that the messages are sent together.
     sleep_time
         The delay between two calls to ``periodic_callback``.
     kwargs
@@ -445,12 +672,33 @@ class TCPStreamPeriodicServer(TCPStreamServer):
         self._periodic_callback = func
 
     async def _emit_periodic(self):
+        deadline = asyncio.get_running_loop().time()
+
         while True:
             if self._server and self.periodic_callback:
-                for transport in self.transports:
-                    await self._do_callback(self.periodic_callback, transport)
+                transports = list(self.transports.items())
+                results = await _call_for_each(
+                    self.periodic_callback,
+                    [transport for transport, _ in transports],
+                )
+
+                writers = []
+                for (_, writer), data in zip(transports, results):
+                    if isinstance(data, (bytes, bytearray)):
+                        writer.write(data)
+                    elif isinstance(data, (list, tuple)):
+                        writer.writelines(data)
+                    else:
+                        continue
+                    writers.append(writer)
+
+                if len(writers) > 0:
+                    await asyncio.gather(
+                        *[writer.drain() for writer in writers],
+                        return_exceptions=True,
+                    )
 
-            await asyncio.sleep(self.sleep_time)
+            deadline = await _sleep_until_next(deadline, self.sleep_time)
 
 
 class TopicListener(object):
@@ -473,6 +721,11 @@ class TopicListener(object):
         The port on which the RabbitMQ message broker is running.
     ssl
         Whether to use TLS/SSL connection.
+    prefetch_count
+        The number of unacknowledged messages that the broker will deliver to
+        the channel. Higher values allow the broker to pipeline messages to
+        the consumers. Use ``prefetch_count=1`` only if strict fair dispatch
+        across several consumers is required.
     """
 
     def __init__(
@@ -484,6 +737,7 @@ class TopicListener(object):
         virtualhost: str = "/",
         port: int = 5672,
         ssl: bool = False,
+        prefetch_count: int = 32,
     ):
         self.url = url
         self.user = user
@@ -492,6 +746,7 @@ class TopicListener(object):
         self.port = port
         self.virtualhost = virtualhost
         self.ssl = ssl
+        self.prefetch_count = prefetch_count
 
         self.connection: apika.abc.AbstractConnection | None = None
         self.channel: apika.abc.AbstractChannel
@@ -499,12 +754,14 @@ class TopicListener(object):
         self.queues: List[apika.abc.AbstractQueue] = []
 
         self._consumer_tag: Dict[apika.abc.AbstractQueue, apika.queue.ConsumerTag] = {}
+        self._owns_connection: bool = True
 
     async def connect(
         self,
         exchange_name: str,
         exchange_type: apika.ExchangeType = apika.ExchangeType.TOPIC,
         on_return_raises=True,
+        connection: apika.abc.AbstractConnection | None = None,
     ) -> TopicListener:
         """Initialise the connection.
 
@@ -514,25 +771,36 @@ class TopicListener(object):
             The name of the exchange to create.
         exchange_type
             The type of exchange to create.
+        connection
+            An open connection to the broker, for example from another
+            `.TopicListener`. If provided, the listener opens its own channel
+            on that connection instead of creating a new connection, which
+            avoids the connection handshake. The connection is not closed when
+            the listener is stopped.
         """
 
-        try:
-            if self.url:
-                self.connection = await apika.connect(self.url)
-            else:
-                self.connection = await apika.connect(
-                    login=self.user,
-                    host=self.host,
-                    port=self.port,
-                    password=self.password,
-                    virtualhost=self.virtualhost,
-                    ssl=self.ssl,
-                )
-        except ConnectionError as err:
-            raise ConnectionError(f"Failed conneting to the AMQP server: {err}.")
+        if connection is not None:
+            self.connection = connection
+            self._owns_connection = False
+        else:
+            try:
+                if self.url:
+                    self.connection = await apika.connect(self.url)
+                else:
+                    self.connection = await apika.connect(
+                        login=self.user,
+                        host=self.host,
+                        port=self.port,
+                        password=self.password,
+                        virtualhost=self.virtualhost,
+                        ssl=self.ssl,
+                    )
+            except ConnectionError as err:
+                raise ConnectionError(f"Failed conneting to the AMQP server: {err}.")
+            self._owns_connection = True
 
         self.channel = await self.connection.channel(on_return_raises=on_return_raises)
-        await self.channel.set_qos(prefetch_count=1)
+        await self.channel.set_qos(prefetch_count=self.prefetch_count)
 
         self.exchange = await self.channel.declare_exchange(
             exchange_name,
@@ -546,7 +814,7 @@ class TopicListener(object):
         self,
         queue_name: str,
         callback: Optional[Callable[[apika.abc.AbstractIncomingMessage], Any]] = None,
-        bindings: Union[str, List[str]] = "*",
+        bindings: Union[str, List[str], Tuple[str, ...]] = "*",
     ) -> apika.abc.AbstractQueue:
         """Adds a queue with bindings.
 
@@ -564,9 +832,7 @@ class TopicListener(object):
 
         if isinstance(bindings, str):
             bindings = bindings.split(",")
-        elif isinstance(bindings, (list, tuple)):
-            bindings = list(bindings)
-        else:
+        elif not isinstance(bindings, (list, tuple)):
             raise TypeError(f"invalid type for bindings {bindings!r}.")
 
         try:
@@ -596,8 +862,10 @@ class TopicListener(object):
             if hasattr(queue, "consumer_tag") and consumer_tag is not None:
                 await queue.cancel(consumer_tag)
 
-        if self.connection:
+        if self.connection and self._owns_connection:
             await self.connection.close()
+        elif self.connection:
+            await self.channel.close()
 
 
 class ReconnectingTCPClientProtocol(asyncio.Protocol):
@@ -643,7 +911,7 @@ class ReconnectingTCPClientProtocol(asyncio.Protocol):
         self._delay = min(self._delay * self.factor, self.max_delay)
         if self.jitter:
             self._delay = random.normalvariate(self._delay, self._delay * self.jitter)
-        self._call_handle = asyncio.get_event_loop().call_later(
+        self._call_handle = asyncio.get_running_loop().call_later(
             self._delay, self.connect
         )
 
@@ -653,14 +921,14 @@ class ReconnectingTCPClientProtocol(asyncio.Protocol):
 
     async def _connect(self):
         try:
-            await asyncio.get_event_loop().create_connection(
+            await asyncio.get_running_loop().create_connection(
                 lambda: self,
                 *self._args,
                 **self._kwargs,
             )
             self.connected = True
         except Exception as exc:
-            asyncio.get_event_loop().call_soon(self.connection_failed, exc)
+            asyncio.get_running_loop().call_soon(self.connection_failed, exc)
         finally:
             self._connector = None
 
@@ -8,9 +8,11 @@
 
 from __future__ import annotations
 
-from collections import defaultdict
+from collections import defaultdict, deque
 from dataclasses import dataclass
 from datetime import datetime
+from functools import partial
+from itertools import islice
 
 from typing import TYPE_CHECKING, Any
 
@@ -31,16 +33,38 @@ class KeywordStore(defaultdict):
     filter
         A list of keyword names to filter. If provided, only those keywords
         will be tracked.
+    max_history
+        The maximum number of outputs to keep for each keyword. When the limit
+        is reached the oldest outputs are discarded. If `None`, all the outputs
+        are kept.
 
     """
 
-    def __init__(self, actor: BaseActor, filter: list[str] | None = None):
+    def __init__(
+        self,
+        actor: BaseActor,
+        filter: list[str] | None = None,
+        max_history: int | None = 10000,
+    ):
         self.actor = actor
         self.name = self.actor.name
 
         self.filter = filter
+        self.max_history = max_history
 
-        defaultdict.__init__(self, list)
+        defaultdict.__init__(self, partial(deque, maxlen=max_history))
+
+    @property
+    def filter(self) -> frozenset[str] | None:
+        """The keywords to track, or `None` to track all keywords."""
+
+        return self._filter
+
+    @filter.setter
+    def filter(self, value: list[str] | None):
+        """Sets the filter. Stored as a `frozenset` for fast lookups."""
+
+        self._filter = frozenset(value) if value is not None else None
 
     def add_reply(self, reply: Reply):
         """Processes a reply and adds new entries to the store.
@@ -53,16 +77,16 @@ class KeywordStore(defaultdict):
 
         """
 
-        for keyword, value in reply.message.items():
-            if self.filter is not None and keyword not in self.filter:
-                continue
+        now = datetime.now()
+        message_code = reply.message_code
+        filter = self._filter
 
-            key_out = KeywordOutput(keyword, reply.message_code, datetime.now(), value)
+        items = reply.message.items()
+        if filter is not None:
+            items = [(kw, value) for kw, value in items if kw in filter]
 
-            if keyword in self:
-                self[keyword].append(key_out)
-            else:
-                self[keyword] = [key_out]
+        for keyword, value in items:
+            self[keyword].append(KeywordOutput(keyword, message_code, now, value))
 
     def head(self, keyword: str, n: int = 1):
         """Returns the first N output values of a keyword.
@@ -76,7 +100,7 @@ class KeywordStore(defaultdict):
 
         """
 
-        return self[keyword][:n]
+        return list(islice(self[keyword], n))
 
     def tail(self, keyword: str, n: int = 1):
         """Returns the last N output values of a keyword.
@@ -90,7 +114,8 @@ class KeywordStore(defaultdict):
 
         """
 
-        return self[keyword][-n:]
+        outputs = self[keyword]
+        return list(islice(outputs, max(len(outputs) - n, 0), None))
 
 
 @dataclass
@@ -111,6 +136,9 @@ class KeywordOutput:
 
     """
 
+    # Equivalent to dataclass(slots=True), which requires Python 3.10+.
+    __slots__ = ("name", "message_code", "date", "value")
+
     name: str
     message_code: Any
     date: datetime
@@ -14,7 +14,7 @@ import re
 import types
 import unittest.mock
 
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, TypeVar
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, TypeVar
 
 import aio_pika
 from aiormq.abc import DeliveredMessage
@@ -31,6 +31,29 @@ if TYPE_CHECKING:
     from pamqp.common import FieldTable
 
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _loads(data: bytes | str) -> Any:
+    """Deserialises JSON using ``orjson``, if available.
+
+    Actors serialise with `json.dumps`, which may output ``NaN`` or
+    ``Infinity``. ``orjson`` rejects those, so we fall back to `json.loads`.
+
+    """
+
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(data)
+
+
 __all__ = ["MockReply", "MockReplyList", "setup_test_actor"]
 
 
@@ -42,6 +65,10 @@ class MockedActor(TCPBaseActor, LegacyActor, AMQPBaseActor):
 T = TypeVar("T", bound=MockedActor)
 
 
+_LEGACY_REPLY_PATTERN = re.compile(r"([0-9]+)\s+([0-9]+)\s+([a-z:>!])\s+(.*)")
+_legacy_match = _LEGACY_REPLY_PATTERN.match
+
+
 class MockReply(dict):
     """Stores a reply written to a transport.
 
@@ -59,6 +86,8 @@ class MockReply(dict):
         The payload of the message.
     """
 
+    __slots__ = ("command_id", "user_id", "flag")
+
     def __init__(
         self,
         user_id: int | str | None,
@@ -82,13 +111,22 @@ class MockReply(dict):
 class MockReplyList(list):
     """Stores replies as `.MockReply` objects."""
 
-    LEGACY_REPLY_PATTERN = re.compile(
-        r"([0-9]+)\s+([0-9]+)\s+((?:[a-z]|\:|\>|\!))\s+(.*)"
-    )
+    LEGACY_REPLY_PATTERN = _LEGACY_REPLY_PATTERN
 
     def __init__(self, actor):
         self.actor = actor
 
+        # The type of actor does not change, so we select the parser only once.
+        self._parse: Callable[[Any], MockReply | None]
+        if isinstance(actor, clu.LegacyActor):
+            self._parse = self._parse_legacy
+        elif isinstance(actor, clu.JSONActor):
+            self._parse = self._parse_json
+        elif isinstance(actor, clu.AMQPActor):
+            self._parse = self._parse_amqp
+        else:
+            self._parse = self._parse_unsupported
+
         list.__init__(self)
 
     def parse_reply(
@@ -98,68 +136,75 @@ class MockReplyList(list):
     ):
         """Parses a reply and construct a `.MockReply`, which is appended."""
 
+        # Skip empty writes, which cannot be replies.
+        if isinstance(reply, (bytes, str)) and not reply.strip():
+            return
+
+        mock_reply = self._parse(reply)
+        if mock_reply is not None:
+            self.append(mock_reply)
+
+    def _parse_legacy(self, reply: bytes | str) -> MockReply | None:
+        """Parses a reply from a `.LegacyActor`."""
+
+        # Replies start with the user ID. Reject anything else before decoding.
+        if not reply[:1].isdigit():
+            return None
+
         if isinstance(reply, bytes):
             reply = reply.decode()
 
-        if issubclass(self.actor.__class__, clu.LegacyActor):
-            assert isinstance(reply, str)
-            match = self.LEGACY_REPLY_PATTERN.match(reply)
-            if not match:
-                return
+        assert isinstance(reply, str)
+        match = _legacy_match(reply)
+        if not match:
+            return None
 
-            user_id, command_id, flag, keywords_raw = match.groups()
+        user_id, command_id, flag, keywords_raw = match.groups()
 
-            user_id = int(user_id)
-            command_id = int(command_id)
+        # Keywords without a value (no "=") get an empty string as value.
+        data = {}
+        for keyword_raw in keywords_raw.split(";"):
+            name, _, value = keyword_raw.partition("=")
+            name = name.strip()
+            if name:
+                data[name] = value.strip()
 
-            data = {}
-            for keyword_raw in keywords_raw.split(";"):
-                if keyword_raw.strip() == "":
-                    continue
-                if "=" in keyword_raw:
-                    name, value = keyword_raw.split("=", maxsplit=1)
-                else:
-                    name = keyword_raw
-                    value = ""
+        return MockReply(int(user_id), int(command_id), flag, data)
 
-                data[name.strip()] = value.strip()
+    def _parse_json(self, reply: bytes | str) -> MockReply:
+        """Parses a reply from a `.JSONActor`."""
 
-        elif issubclass(self.actor.__class__, clu.JSONActor):
-            assert isinstance(reply, str)
-            reply_dict: Dict[str, Any] = json.loads(reply)
+        assert isinstance(reply, (bytes, str))
+        reply_dict: Dict[str, Any] = _loads(reply)
 
-            header = reply_dict["header"]
-            user_id = header.pop("commander_id", None)
-            command_id = header.pop("command_id", None)
-            flag = header.pop("message_code", "d")
+        header = reply_dict["header"]
+        user_id = header.get("commander_id", None)
+        command_id = header.get("command_id", None)
+        flag = header.get("message_code", "d")
 
-            data = reply_dict["data"]
+        return MockReply(user_id, command_id, flag, reply_dict["data"])
 
-        elif issubclass(self.actor.__class__, clu.AMQPActor):
-            assert isinstance(reply, aio_pika.Message)
+    def _parse_amqp(self, reply: aio_pika.Message) -> MockReply:
+        """Parses a reply from an `.AMQPActor`."""
 
-            header = reply.headers
+        assert isinstance(reply, aio_pika.Message)
 
-            user_id = header.get("commander_id", None)
-            command_id = header.get("command_id", None)
-            flag = header.get("message_code", "d")
+        header = reply.headers
 
-            data = json.loads(reply.body.decode())
+        user_id = header.get("commander_id", None)
+        command_id = header.get("command_id", None)
+        flag = header.get("message_code", "d")
 
-        else:
-            raise RuntimeError("This type of actor is not supported")
-
-        assert isinstance(user_id, (int, str)) or user_id is None
-        assert isinstance(command_id, (int, str)) or command_id is None
-        assert isinstance(flag, str)
+        return MockReply(user_id, command_id, flag, _loads(reply.body))
 
-        list.append(self, MockReply(user_id, command_id, flag, data))
+    def _parse_unsupported(self, reply: Any) -> MockReply | None:
+        raise RuntimeError("This type of actor is not supported")
 
     def clear(self):
-        list.__init__(self)
+        list.clear(self)
 
     def __contains__(self, m):
-        return any([m in reply[kw] for reply in self for kw in reply.keys()])
+        return any(m in value for reply in self for value in reply.values())
 
 
 async def setup_test_actor(actor: T, user_id: int = 666) -> T:
@@ -178,16 +223,19 @@ async def setup_test_actor(actor: T, user_id: int = 666) -> T:
     The actor is modified in place and returned.
     """
 
-    if not issubclass(actor.__class__, (clu.LegacyActor, clu.JSONActor, clu.AMQPActor)):
+    if not isinstance(actor, (clu.LegacyActor, clu.JSONActor, clu.AMQPActor)):
         raise RuntimeError("setup_test_actor is not implemented for this type of actor")
 
+    is_tcp = isinstance(actor, (clu.LegacyActor, clu.JSONActor))
+
     def invoke_mock_command(self, command_str, command_id=0):
-        if issubclass(actor.__class__, (clu.LegacyActor, clu.JSONActor)):
+        if is_tcp:
             if isinstance(command_str, str):
-                command_str = command_str.encode("utf-8")
-            full_command = f" {command_id} ".encode("utf-8") + command_str
+                full_command = f" {command_id} {command_str}".encode("utf-8")
+            else:
+                full_command = f" {command_id} ".encode("utf-8") + command_str
             return self.new_command(actor.transports[user_id], full_command)
-        elif issubclass(actor.__class__, clu.AMQPActor):
+        else:
             command_id = str(command_id)
             headers: FieldTable = {
                 "command_id": command_id,
@@ -220,12 +268,12 @@ async def setup_test_actor(actor: T, user_id: int = 666) -> T:
     # Mocks a user transport and stores the replies in a MockReplyListobject
     actor.mock_replies = MockReplyList(actor)
 
-    if issubclass(actor.__class__, (clu.LegacyActor, clu.JSONActor)):
+    if is_tcp:
         mock_transport = unittest.mock.MagicMock(spec=asyncio.Transport)
         mock_transport.user_id = user_id
         mock_transport.write.side_effect = actor.mock_replies.parse_reply
         actor.transports[user_id] = mock_transport
-    elif issubclass(actor.__class__, clu.AMQPActor):
+    else:
         assert actor.connection
         actor.connection.exchange = unittest.mock.MagicMock()
         actor.connection.exchange.publish = unittest.mock.AsyncMock(
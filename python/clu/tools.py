@@ -26,6 +26,7 @@ from typing import (
     Generic,
     List,
     Optional,
+    Set,
     Tuple,
     Type,
     TypeVar,
@@ -50,6 +51,7 @@ __all__ = [
 
 REPLY = 5  # REPLY logging level
 WARNING_REGEX = r"^.*?\s*?(\w*?Warning): (.*)"
+_WARNING_RE = re.compile(WARNING_REGEX)
 
 
 class Maskbit(enum.Flag):
@@ -59,11 +61,19 @@ class Maskbit(enum.Flag):
     def active_bits(self) -> List[Maskbit]:
         """Returns a list of non-combination flags that match the value."""
 
-        return [
-            bit
-            for bit in self.__class__  # type: ignore
-            if ((bit.value & self.value) and bin(bit.value).count("1") == 1)
-        ]
+        value = self.value
+        return [bit for bit in _single_bits(self.__class__) if bit.value & value]
+
+
+@functools.lru_cache(maxsize=None)
+def _single_bits(maskbit_class: Type[Maskbit]) -> Tuple[Maskbit, ...]:
+    """Returns the non-combination flags of a `.Maskbit` class."""
+
+    return tuple(
+        bit
+        for bit in maskbit_class  # type: ignore
+        if bit.value and (bit.value & (bit.value - 1)) == 0
+    )
 
 
 COMMAND_STATUS_TO_CODE: Dict[str, str] = {
@@ -97,11 +107,8 @@ class CommandStatus(Maskbit):
     ALL_STATES = READY | ACTIVE_STATES | DONE_STATES
 
     def __init__(self, *args):
-        self.code: str | None
-        if self.name and self.name.upper() in COMMAND_STATUS_TO_CODE:
-            self.code = COMMAND_STATUS_TO_CODE[self.name.upper()]
-        else:
-            self.code = None
+        # Member names are already upper case.
+        self.code: str | None = COMMAND_STATUS_TO_CODE.get(self.name or "")
 
     @property
     def is_combination(self) -> bool:
@@ -109,15 +116,13 @@ class CommandStatus(Maskbit):
 
         assert isinstance(self.value, int)
 
-        if bin(self.value).count("1") > 1:
-            return True
-        return False
+        return (self.value & (self.value - 1)) != 0
 
     @property
     def did_fail(self) -> bool:
         """Command failed or was cancelled."""
 
-        return self in self.FAILED_STATES
+        return self._value_ & _FAILED_STATES == self._value_
 
     @property
     def did_succeed(self) -> bool:
@@ -129,19 +134,19 @@ class CommandStatus(Maskbit):
     def is_active(self) -> bool:
         """Command is running, cancelling or failing."""
 
-        return self in self.ACTIVE_STATES
+        return self._value_ & _ACTIVE_STATES == self._value_
 
     @property
     def is_done(self) -> bool:
         """Command is done (whether successfully or not)."""
 
-        return self in self.DONE_STATES
+        return self._value_ & _DONE_STATES == self._value_
 
     @property
     def is_failing(self) -> bool:
         """Command is being cancelled or is failing."""
 
-        return self in self.FAILING_STATES
+        return self._value_ & _FAILING_STATES == self._value_
 
     @staticmethod
     def code_to_status(code, default: Optional[CommandStatus] = None) -> CommandStatus:
@@ -162,6 +167,14 @@ class CommandStatus(Maskbit):
         return statuses.get(code, default or CommandStatus.RUNNING)
 
 
+# Integer masks for the status checks, which are called very often. Equivalent
+# to "status in CommandStatus.X_STATES" but without the enum machinery.
+_ACTIVE_STATES: int = CommandStatus.ACTIVE_STATES.value
+_FAILED_STATES: int = CommandStatus.FAILED_STATES.value
+_FAILING_STATES: int = CommandStatus.FAILING_STATES.value
+_DONE_STATES: int = CommandStatus.DONE_STATES.value
+
+
 MaskbitType = TypeVar("MaskbitType", bound=Maskbit)
 
 
@@ -201,6 +214,9 @@ class StatusMixIn(Generic[MaskbitType]):
         self._status: MaskbitType | None = initial_status
         self.watcher: Optional[asyncio.Event] = None
 
+        # Futures of the callers of wait_for_status and the status they await.
+        self._status_waiters: List[Tuple[MaskbitType, asyncio.Future]] = []
+
         if callback_func is not None:
             if isinstance(callback_func, (list, tuple)):
                 self.callbacks = callback_func
@@ -215,11 +231,19 @@ class StatusMixIn(Generic[MaskbitType]):
 
         assert hasattr(self, "callbacks"), "missing callbacks attribute."
 
-        loop = asyncio.get_event_loop()
+        status = self.status
+        if not self.callbacks or not status:
+            return
 
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called from synchronous code. Schedule in the default loop.
+            loop = asyncio.get_event_loop()
+
+        call_soon = loop.call_soon
         for func in self.callbacks:
-            if self.status:
-                loop.call_soon(func, self.status)
+            call_soon(func, status)
 
     @property
     def status(self):
@@ -234,23 +258,39 @@ class StatusMixIn(Generic[MaskbitType]):
         if value != self._status:
             self._status = value
             self.do_callbacks()
+            self.notify_status_waiters()
             if self.watcher is not None:
                 self.watcher.set()
 
+    def notify_status_waiters(self):
+        """Resolves the `.wait_for_status` calls that match the current status."""
+
+        if not self._status_waiters:
+            return
+
+        status = self._status
+
+        pending = []
+        for value, future in self._status_waiters:
+            if future.done():
+                continue
+            if value == status:
+                future.set_result(None)
+            else:
+                pending.append((value, future))
+
+        self._status_waiters = pending
+
     async def wait_for_status(self, value):
         """Awaits until the status matches ``value``."""
 
         if self.status == value:
             return
 
-        self.watcher = asyncio.Event()
-
-        while self.status != value:
-            await self.watcher.wait()
-            if self.watcher is not None:
-                self.watcher.clear()
+        future = asyncio.get_running_loop().create_future()
+        self._status_waiters.append((value, future))
 
-        self.watcher = None
+        await future
 
 
 class CallbackMixIn(object):
@@ -268,23 +308,27 @@ class CallbackMixIn(object):
         loop: Optional[asyncio.AbstractEventLoop] = None,
     ):
         self._callbacks = []
+        self._callback_specs: List[Tuple[Callable[..., Any], int, bool]] = []
         for cb in callbacks:
             self.register_callback(cb)
 
-        self._running = []  # Running callbacks
+        self._running: Set[asyncio.Task] = set()  # Running callbacks
 
     async def stop_callbacks(self):
         """Cancels any running callback task."""
 
-        for cb in self._running:
+        # Tasks remove themselves from the set when done, so we iterate a copy.
+        running = list(self._running)
+
+        for cb in running:
             if not cb.done():
                 cb.cancel()
 
         with contextlib.suppress(asyncio.CancelledError):
-            for cb in self._running:
+            for cb in running:
                 await cb
 
-        self._running = []
+        self._running = set()
 
     def register_callback(self, callback_func: Callable[..., Any]):
         """Adds a callback function or coroutine function."""
@@ -292,13 +336,25 @@ class CallbackMixIn(object):
         assert callable(callback_func), "callback_func must be a callable."
         self._callbacks.append(callback_func)
 
+        # Inspecting the callback is expensive so we do it only once.
+        self._callback_specs.append(
+            (
+                callback_func,
+                len(inspect.getfullargspec(callback_func).args),
+                asyncio.iscoroutinefunction(callback_func),
+            )
+        )
+
     def remove_callback(self, callback_func: Callable[..., Any]):
         """Removes a callback function."""
 
         assert (
             callback_func in self._callbacks
         ), "callback_func is not in the list of callbacks."
-        self._callbacks.remove(callback_func)
+
+        index = self._callbacks.index(callback_func)
+        del self._callbacks[index]
+        del self._callback_specs[index]
 
     def notify(self, *args):
         """Calls the callback functions with some arguments.
@@ -311,13 +367,12 @@ class CallbackMixIn(object):
         if self._callbacks is None:
             return
 
-        for cb in self._callbacks:
-            n_args = len(inspect.getfullargspec(cb).args)
-            if asyncio.iscoroutinefunction(cb):
+        for cb, n_args, is_coroutine in self._callback_specs:
+            if is_coroutine:
                 task = asyncio.create_task(cb(*args[:n_args]))
-                self._running.append(task)
+                self._running.add(task)
                 # Auto-dispose of the task once it completes
-                task.add_done_callback(self._running.remove)
+                task.add_done_callback(self._running.discard)
             else:
                 cb(*args[:n_args])
 
@@ -344,7 +399,7 @@ def format_value(value: Any) -> str:
     """
 
     if isinstance(value, str):
-        if " " in value and not (value.startswith("'") or value.startswith('"')):
+        if " " in value and not value.startswith(("'", '"')):
             value = escape(value)
         # for char in ",/:_-":
         #     if char in value:
@@ -353,9 +408,10 @@ def format_value(value: Any) -> str:
     elif isinstance(value, bool):
         value = "T" if value else "F"
     elif isinstance(value, (tuple, list)):
-        value = ",".join([format_value(item) for item in value])
+        value = ",".join(map(format_value, value))
     elif isinstance(value, dict):
-        if dict_depth(value) > 1:
+        # Equivalent to dict_depth(value) > 1 but stops at the first nested dict.
+        if any(isinstance(item, dict) for item in value.values()):
             raise ValueError("Cannot format a dictionary with depth > 1.")
         value = format_value(list(value.values()))
     else:
@@ -377,34 +433,24 @@ class CaseInsensitiveDict(Dict[str, T]):
     """A dictionary that performs case-insensitive operations."""
 
     def __init__(self, values: Any):
-        self._lc = []
+        self._lc: Dict[str, str] = {}
 
         dict.__init__(self, values)
 
-        self._lc = [key.lower() for key in values]
-        assert len(set(self._lc)) == len(
-            self._lc
-        ), "the are duplicated items in the dict."
+        # Maps the lower-case version of each key to the key as stored.
+        self._lc = {key.lower(): key for key in self}
+        assert len(self._lc) == len(self), "the are duplicated items in the dict."
 
     def __get_key__(self, key):
         """Returns the correct value of the key, regardless of its case."""
 
-        try:
-            idx = self._lc.index(key.lower())
-        except ValueError:
-            return key
-
-        return list(self)[idx]
+        return self._lc.get(key.lower(), key)
 
     def __getitem__(self, key):
         return dict.__getitem__(self, self.__get_key__(key))
 
     def __setitem__(self, key, value):
-        if key.lower() not in self._lc:
-            self._lc.append(key.lower())
-            dict.__setitem__(self, key, value)
-        else:
-            dict.__setitem__(self, self.__get_key__(key), value)
+        dict.__setitem__(self, self._lc.setdefault(key.lower(), key), value)
 
     def __contains__(self, key):
         return dict.__contains__(self, self.__get_key__(key))
@@ -416,11 +462,16 @@ class CaseInsensitiveDict(Dict[str, T]):
 def cli_coro(f):
     """Decorator function that allows defining coroutines with click."""
 
+    @functools.wraps(f)
     def wrapper(*args, **kwargs):
+        # Unlike asyncio.run, this does not unset the current event loop.
         loop = asyncio.new_event_loop()
-        return loop.run_until_complete(f(*args, **kwargs))
+        try:
+            return loop.run_until_complete(f(*args, **kwargs))
+        finally:
+            loop.close()
 
-    return functools.update_wrapper(wrapper, f)
+    return wrapper
 
 
 async def as_complete_failer(
@@ -453,9 +504,10 @@ async def as_complete_failer(
     if not isinstance(aws, (list, tuple)):
         aws = [aws]
 
-    loop = kwargs.get("loop", asyncio.get_event_loop())
+    # as_completed does not accept loop in Python 3.10+.
+    loop = kwargs.pop("loop", None) or asyncio.get_running_loop()
 
-    tasks = [loop.create_task(aw) for aw in aws]
+    tasks = [asyncio.ensure_future(aw, loop=loop) for aw in aws]
 
     failed = False
     error_message = None
@@ -472,10 +524,11 @@ async def as_complete_failer(
 
     if failed:
         # Cancel tasks
-        [task.cancel() for task in tasks]
+        for task in tasks:
+            task.cancel()
 
-        with contextlib.suppress(BaseException):
-            await asyncio.gather(*[task for task in tasks])
+        # Unlike gather, wait does not raise the exceptions of the tasks.
+        await asyncio.wait(tasks)
 
         if on_fail_callback:
             if asyncio.iscoroutinefunction(on_fail_callback):
@@ -488,6 +541,16 @@ async def as_complete_failer(
     return (True, None)
 
 
+CODE_TO_LOG_LEVEL: Dict[str, int] = {
+    "f": logging.ERROR,
+    "e": logging.ERROR,
+    "w": logging.WARNING,
+    "i": logging.INFO,
+    ":": logging.INFO,
+    "d": logging.DEBUG,
+}
+
+
 def log_reply(
     log: logging.Logger,
     message_code: MessageCode,
@@ -496,17 +559,8 @@ def log_reply(
 ):
     """Logs an actor message with the correct code."""
 
-    code_dict = {
-        "f": logging.ERROR,
-        "e": logging.ERROR,
-        "w": logging.WARNING,
-        "i": logging.INFO,
-        ":": logging.INFO,
-        "d": logging.DEBUG,
-    }
-
     if use_message_code:
-        log.log(code_dict[message_code.value], message)
+        log.log(CODE_TO_LOG_LEVEL[message_code.value], message)
     else:
         # Sets the REPLY log level
         log_level_no = REPLY
@@ -583,9 +637,10 @@ class ActorHandler(logging.Handler):
             code = self.code_mapping[logging.INFO]
         elif record.levelno <= logging.WARNING:
             code = self.code_mapping[logging.WARNING]
-            warning_category_groups = re.match(WARNING_REGEX, message)
-            if warning_category_groups is not None:
-                message_lines = self._filter_warning(warning_category_groups)
+            if "Warning" in message:
+                warning_category_groups = _WARNING_RE.match(message)
+                if warning_category_groups is not None:
+                    message_lines = self._filter_warning(warning_category_groups)
         elif record.levelno >= logging.ERROR:
             code = self.code_mapping[logging.ERROR]
         else:
@@ -7,15 +7,20 @@
 # @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
 
 import asyncio
+import socket
 import sys
+import types
 
 import pytest
 
 from clu.protocol import (
+    PeriodicTCPServer,
+    TCPProtocol,
     TCPStreamClient,
     TCPStreamPeriodicServer,
     TCPStreamServer,
     TopicListener,
+    install_uvloop,
     open_connection,
 )
 
@@ -42,6 +47,186 @@ async def test_max_connections(tcp_server):
 
     assert received == b"Max number of connections reached.\n"
 
+    # The rejected connection is closed by the server.
+    assert await client2.reader.read() == b""
+    assert len(tcp_server.transports) == 1
+
+
+async def test_data_received_async_callable(unused_tcp_port_factory):
+    received = []
+
+    class AsyncCallback:
+        async def __call__(self, transport, data):
+            received.append(data)
+
+    tcp = TCPStreamServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        data_received_callback=AsyncCallback(),
+    )
+    await tcp.start()
+
+    client = await open_connection("localhost", tcp.port)
+    client.writer.write(b"hello\n")
+    await client.writer.drain()
+
+    await asyncio.sleep(0.05)
+
+    assert received == [b"hello\n"]
+
+    client.close()
+    tcp.stop()
+
+
+async def test_data_received_returns_future(unused_tcp_port_factory):
+    # Actors return the Command (a Future) from new_command. The server must not
+    # wait for it to finish before reading the next command.
+
+    loop = asyncio.get_running_loop()
+    received = []
+
+    def callback(transport, data):
+        received.append((data, loop.time()))
+        future = loop.create_future()
+        if data == b"slow\n":
+            loop.call_later(1, future.set_result, None)
+        else:
+            future.set_result(None)
+        return future
+
+    tcp = TCPStreamServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        data_received_callback=callback,
+    )
+    await tcp.start()
+
+    client = await open_connection("localhost", tcp.port)
+    start = loop.time()
+    client.writer.write(b"slow\nfast\n")
+    await client.writer.drain()
+
+    await asyncio.sleep(0.1)
+
+    assert [data for data, _ in received] == [b"slow\n", b"fast\n"]
+    assert received[1][1] - start < 0.5
+
+    client.close()
+    tcp.stop()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="SO_REUSEPORT not supported")
+async def test_reuse_port(unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+
+    tcp1 = TCPStreamServer("localhost", port, reuse_port=True)
+    tcp2 = TCPStreamServer("localhost", port, reuse_port=True)
+
+    await tcp1.start()
+    await tcp2.start()
+
+    assert tcp1.is_serving()
+    assert tcp2.is_serving()
+
+    tcp1.stop()
+    tcp2.stop()
+
+
+async def test_length_framing(unused_tcp_port_factory):
+    received = []
+
+    tcp = TCPStreamServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        data_received_callback=lambda transport, data: received.append(data),
+        framing="length",
+    )
+    await tcp.start()
+
+    client = await open_connection("localhost", tcp.port)
+    for message in [b"hello\nworld", b"", b"bye"]:
+        client.writer.write(len(message).to_bytes(4, "big") + message)
+    await client.writer.drain()
+
+    await asyncio.sleep(0.05)
+
+    assert received == [b"hello\nworld", b"", b"bye"]
+
+    client.close()
+    tcp.stop()
+
+
+async def test_length_framing_limit(unused_tcp_port_factory):
+    received = []
+
+    tcp = TCPStreamServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        data_received_callback=lambda transport, data: received.append(data),
+        framing="length",
+        reader_limit=16,
+    )
+    await tcp.start()
+
+    client = await open_connection("localhost", tcp.port)
+    client.writer.write(len(b"short").to_bytes(4, "big") + b"short")
+    client.writer.write((10_000_000).to_bytes(4, "big") + b"x" * 64)
+    await client.writer.drain()
+
+    assert await asyncio.wait_for(client.reader.read(), 1) == b""
+
+    assert received == [b"short"]
+    assert len(tcp.transports) == 0
+
+    client.close()
+    tcp.stop()
+
+
+async def test_reader_limit(unused_tcp_port_factory):
+    received = []
+
+    tcp = TCPStreamServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        data_received_callback=lambda transport, data: received.append(data),
+        reader_limit=16,
+    )
+    await tcp.start()
+
+    client = await open_connection("localhost", tcp.port)
+    client.writer.write(b"short\n" + b"x" * 64 + b"\n")
+    await client.writer.drain()
+
+    await asyncio.sleep(0.05)
+
+    assert received == [b"short\n"]
+    assert len(tcp.transports) == 0
+
+    client.close()
+    tcp.stop()
+
+
+async def test_connection_options(unused_tcp_port_factory):
+    tcp = TCPStreamServer("localhost", unused_tcp_port_factory())
+    await tcp.start()
+
+    client = await open_connection("localhost", tcp.port)
+    await asyncio.sleep(0.01)
+
+    transport = list(tcp.transports)[0]
+    sock = transport.get_extra_info("socket")
+    assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE) != 0
+
+    assert transport.get_write_buffer_limits() == (2**18, 2**20)
+
+    client.close()
+    tcp.stop()
+
+
+def test_invalid_framing():
+    with pytest.raises(ValueError):
+        TCPStreamServer("localhost", 5555, framing="bad")  # type: ignore
+
 
 async def test_close_client_fails(tcp_server):
     # Uninitialised client
@@ -71,6 +256,201 @@ async def test_periodic_server(unused_tcp_port_factory, mocker):
     periodic_server.stop()
 
 
+async def test_periodic_server_returns_bytes(unused_tcp_port_factory):
+    periodic_server = TCPStreamPeriodicServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        periodic_callback=lambda transport: b"tick\n",
+        sleep_time=0.01,
+    )
+    await periodic_server.start()
+
+    client = await open_connection("localhost", periodic_server.port)
+
+    received = await asyncio.wait_for(client.reader.readline(), 1)
+    assert received == b"tick\n"
+
+    client.close()
+    periodic_server.stop()
+
+
+@pytest.mark.parametrize("server_class", [TCPProtocol, PeriodicTCPServer])
+async def test_tcp_protocol_create_server(server_class, unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+    server = await server_class.create_server("localhost", port)
+
+    assert server.is_serving()
+
+    client = await open_connection("localhost", port)
+    client.close()
+
+    server.close()
+
+
+async def test_tcp_protocol_create_client(unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+
+    received = []
+    server = await TCPProtocol.create_server(
+        "localhost",
+        port,
+        data_received_callback=received.append,
+    )
+
+    client_received = []
+    transport, protocol = await TCPProtocol.create_client(
+        "localhost",
+        port,
+        data_received_callback=client_received.append,
+    )
+
+    assert isinstance(protocol, TCPProtocol)
+    assert protocol.transports == [transport]
+
+    transport.write(b"hello")
+    await asyncio.sleep(0.01)
+
+    assert received == ["hello"]
+
+    transport.close()
+    server.close()
+
+
+async def test_tcp_protocol_connection_lost(unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+
+    protocol = TCPProtocol()
+    server = await asyncio.get_running_loop().create_server(
+        lambda: protocol,
+        "localhost",
+        port,
+    )
+
+    client = await open_connection("localhost", port)
+    await asyncio.sleep(0.01)
+    assert len(protocol.transports) == 1
+    assert protocol.loop is asyncio.get_running_loop()
+
+    client.close()
+    await asyncio.sleep(0.01)
+    assert len(protocol.transports) == 0
+
+    server.close()
+
+
+async def test_periodic_tcp_server_no_decode(unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+
+    received = []
+    server = await PeriodicTCPServer.create_server(
+        "localhost",
+        port,
+        data_received_callback=received.append,
+        decode=False,
+    )
+
+    client = await open_connection("localhost", port)
+    client.writer.write(b"\xff\x00")
+    await client.writer.drain()
+    await asyncio.sleep(0.01)
+
+    assert received == [b"\xff\x00"]
+
+    client.close()
+    server.close()
+
+
+def test_tcp_protocol_no_running_loop():
+    protocol = TCPProtocol()
+    assert protocol.loop is None
+
+
+def test_install_uvloop(monkeypatch):
+    class EventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+        pass
+
+    fake_uvloop = types.ModuleType("uvloop")
+    fake_uvloop.EventLoopPolicy = EventLoopPolicy
+    monkeypatch.setitem(sys.modules, "uvloop", fake_uvloop)
+
+    policy = asyncio.get_event_loop_policy()
+
+    try:
+        assert install_uvloop() is True
+        assert isinstance(asyncio.get_event_loop_policy(), EventLoopPolicy)
+    finally:
+        asyncio.set_event_loop_policy(policy)
+
+
+def test_install_uvloop_not_available(monkeypatch):
+    # A None entry in sys.modules makes the import raise ImportError.
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+
+    policy = asyncio.get_event_loop_policy()
+
+    assert install_uvloop() is False
+    assert asyncio.get_event_loop_policy() is policy
+
+
+async def test_stream_server_callback_fails(unused_tcp_port_factory):
+    def bad_callback(transport, data):
+        raise ValueError("bad callback")
+
+    tcp = TCPStreamServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        data_received_callback=bad_callback,
+    )
+    await tcp.start()
+
+    client = await open_connection("localhost", tcp.port)
+    client.writer.write(b"hello\n")
+    await client.writer.drain()
+    await asyncio.sleep(0.01)
+
+    assert len(tcp.transports) == 0
+
+    client.close()
+    tcp.stop()
+
+
+async def test_periodic_server_returns_list(unused_tcp_port_factory):
+    periodic_server = TCPStreamPeriodicServer(
+        "localhost",
+        unused_tcp_port_factory(),
+        periodic_callback=lambda transport: [b"header ", b"body\n"],
+        sleep_time=0.01,
+    )
+    await periodic_server.start()
+
+    client = await open_connection("localhost", periodic_server.port)
+
+    received = await asyncio.wait_for(client.reader.readline(), 1)
+    assert received == b"header body\n"
+
+    client.close()
+    periodic_server.stop()
+
+
+async def test_periodic_tcp_server_returns_bytes(unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+
+    server = await PeriodicTCPServer.create_server(
+        "localhost",
+        port,
+        periodic_callback=lambda transport: [b"header ", b"body\n"],
+        sleep_time=0.01,
+    )
+
+    client = await open_connection("localhost", port)
+
+    received = await asyncio.wait_for(client.reader.readline(), 1)
+    assert received == b"header body\n"
+
+    client.close()
+    server.close()
+
+
 async def test_topic_listener_url(amqp_actor):
     port = amqp_actor.connection.port
 
@@ -83,3 +463,21 @@ async def test_topic_listener_url(amqp_actor):
     assert listener.connection.connected.is_set()
 
     await listener.stop()
+
+
+async def test_topic_listener_shared_connection(amqp_actor):
+    port = amqp_actor.connection.port
+
+    listener1 = TopicListener(port=port)
+    await listener1.connect("test")
+
+    listener2 = TopicListener(port=port)
+    await listener2.connect("test", connection=listener1.connection)
+
+    assert listener2.connection is listener1.connection
+    assert listener2.channel is not listener1.channel
+
+    await listener2.stop()
+    assert not listener1.connection.is_closed
+
+    await listener1.stop()
@@ -8,6 +8,8 @@
 
 from __future__ import annotations
 
+from collections import deque
+
 import pytest
 
 from clu.actor import AMQPActor
@@ -34,7 +36,7 @@ def test_store(store):
     assert isinstance(store, KeywordStore)
 
     assert len(store) == 1
-    assert store["hi!"] == []
+    assert len(store["hi!"]) == 0
 
 
 def test_store_filter(store):
@@ -53,7 +55,7 @@ def test_store_filter(store):
 
 def test_store_add_reply(store):
     assert len(store["key"]) == 2
-    assert isinstance(store["key"], list)
+    assert isinstance(store["key"], deque)
     assert isinstance(store["key"][0], KeywordOutput)
 
     assert store["key"][0].message_code == "i"
@@ -74,3 +76,14 @@ def test_store_tail(store):
     assert len(store.tail("key", 3)) == 2
 
     assert store.tail("key")[0].value == 2
+
+
+def test_store_max_history():
+    store = KeywordStore(AMQPActor(name="test_actor"), max_history=2)
+
+    for value in range(5):
+        store.add_reply(Reply("i", {"key": value}))
+
+    assert len(store["key"]) == 2
+    assert [output.value for output in store.head("key", 2)] == [3, 4]
+    assert [output.value for output in store.tail("key", 5)] == [3, 4]
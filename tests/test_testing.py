@@ -7,13 +7,16 @@
 # @License: BSD 3-clause (http://www.opensource.org/licenses/BSD-3-Clause)
 
 import asyncio
+import json
+import types
 
 import pytest
 
+import clu.testing
 from clu.command import Command
 from clu.legacy import LegacyActor
 from clu.parsers.click import command_parser, timeout
-from clu.testing import setup_test_actor
+from clu.testing import MockReply, setup_test_actor
 
 
 pytestmark = [pytest.mark.asyncio]
@@ -132,3 +135,103 @@ async def test_amqp_actor(amqp_actor):
     assert len(amqp_actor.mock_replies) == 2
     assert amqp_actor.mock_replies[-1].flag == ":"
     assert amqp_actor.mock_replies[-1]["text"] == "Pong."
+
+
+async def test_json_actor_parse_nan(json_actor):
+    json_actor = await setup_test_actor(json_actor)
+
+    json_actor.mock_replies.parse_reply(
+        b'{"header": {"message_code": "i"}, "data": {"value": NaN}}'
+    )
+
+    assert len(json_actor.mock_replies) == 1
+    assert json_actor.mock_replies[0]["value"] != json_actor.mock_replies[0]["value"]
+
+
+async def test_json_actor_parse_orjson(json_actor, monkeypatch):
+    calls = []
+
+    class JSONDecodeError(ValueError):
+        pass
+
+    def loads(data):
+        calls.append(data)
+        if b"NaN" in data:
+            raise JSONDecodeError("NaN is not valid JSON")
+        return json.loads(data)
+
+    fake_orjson = types.SimpleNamespace(loads=loads, JSONDecodeError=JSONDecodeError)
+    monkeypatch.setattr(clu.testing, "orjson", fake_orjson)
+
+    json_actor = await setup_test_actor(json_actor)
+
+    json_actor.mock_replies.parse_reply(
+        b'{"header": {"message_code": "i"}, "data": {"value": 1}}'
+    )
+    json_actor.mock_replies.parse_reply(
+        b'{"header": {"message_code": "i"}, "data": {"value": NaN}}'
+    )
+
+    assert len(calls) == 2
+    assert len(json_actor.mock_replies) == 2
+    assert json_actor.mock_replies[0]["value"] == 1
+    assert json_actor.mock_replies[1]["value"] != json_actor.mock_replies[1]["value"]
+
+
+def test_mock_reply_slots():
+    reply = MockReply(1, 2, "i", {"key": "value"})
+
+    assert not hasattr(reply, "__dict__")
+    assert reply.flag == "i"
+    assert reply["key"] == "value"
+
+
+async def test_parse_empty_reply(actor):
+    actor.mock_replies.parse_reply(b"")
+    actor.mock_replies.parse_reply(" \n")
+
+    assert len(actor.mock_replies) == 0
+
+
+async def test_mock_replies_contains(actor):
+    cmd = actor.invoke_mock_command("ping")
+    await cmd
+
+    assert "Pong." in actor.mock_replies
+    assert "Pong" in actor.mock_replies
+    assert "Ping." not in actor.mock_replies
+
+    actor.mock_replies.clear()
+    assert "Pong." not in actor.mock_replies
+
+
+async def test_parse_legacy_not_a_reply(actor):
+    actor.mock_replies.parse_reply(b"not a reply\n")
+    actor.mock_replies.parse_reply("1 not a reply\n")
+
+    assert len(actor.mock_replies) == 0
+
+
+async def test_mock_replies_contains_after_mutation(actor):
+    replies = actor.mock_replies
+
+    replies.append(MockReply(1, 1, "i", {"text": "hello"}))
+    replies.pop()
+    assert "hello" not in replies
+
+    replies.extend([MockReply(1, 1, "i", {"text": "world"})])
+    assert "world" in replies
+
+    del replies[:]
+    assert "world" not in replies
+
+    replies += [MockReply(1, 1, "i", {"text": "again"})]
+    assert "again" in replies
+
+    replies[0] = MockReply(1, 1, "i", {"text": "replaced"})
+    assert "again" not in replies
+    assert "replaced" in replies
+
+
+async def test_actor_start_mocked(actor):
+    actor.start.assert_awaited_once()
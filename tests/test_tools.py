@@ -17,9 +17,11 @@ import pytest
 from clu import ActorHandler, CluWarning
 from clu.tools import (
     CallbackMixIn,
+    CaseInsensitiveDict,
     CommandStatus,
     StatusMixIn,
     as_complete_failer,
+    cli_coro,
     format_value,
 )
 
@@ -55,6 +57,25 @@ async def test_callback_mixin(callback_object):
     assert callback_func not in callback_object._callbacks
 
 
+@pytest.mark.asyncio
+async def test_callback_removed_not_notified(callback_object):
+    results = []
+
+    def callback1(value):
+        results.append(("callback1", value))
+
+    def callback2():
+        results.append(("callback2",))
+
+    callback_object.register_callback(callback1)
+    callback_object.register_callback(callback2)
+    callback_object.remove_callback(callback1)
+
+    callback_object.notify(42)
+
+    assert results == [("callback2",)]
+
+
 @pytest.mark.asyncio
 async def test_callback_coro(callback_object):
     results = []
@@ -247,6 +268,26 @@ class TestStatusMixIn:
         assert s.status == CommandStatus.READY
         assert s.watcher is None
 
+    async def test_wait_for_status_multiple(self, event_loop):
+        def set_status(mixin, status):
+            mixin.status = status
+
+        s = StatusMixIn(CommandStatus, CommandStatus.READY)
+
+        event_loop.call_later(0.01, set_status, s, CommandStatus.RUNNING)
+        event_loop.call_later(0.02, set_status, s, CommandStatus.DONE)
+
+        await asyncio.wait_for(
+            asyncio.gather(
+                s.wait_for_status(CommandStatus.RUNNING),
+                s.wait_for_status(CommandStatus.DONE),
+                s.wait_for_status(CommandStatus.DONE),
+            ),
+            1,
+        )
+
+        assert s.status == CommandStatus.DONE
+
 
 class TestCommandStatus:
     CS = CommandStatus
@@ -324,3 +365,41 @@ class TestAsCompleteFailer:
         await as_complete_failer(self.raise_error(), on_fail_callback=cb)
 
         cb.assert_called_once()
+
+
+def test_case_insensitive_dict():
+    data = CaseInsensitiveDict({"Key1": 1})
+
+    assert data["key1"] == 1
+    assert data["KEY1"] == 1
+    assert "kEy1" in data
+
+    data["KEY1"] = 2
+    data["Key2"] = 3
+
+    assert list(data) == ["Key1", "Key2"]
+    assert data["key1"] == 2
+    assert data["key2"] == 3
+    assert "key3" not in data
+
+
+def test_case_insensitive_dict_duplicated():
+    with pytest.raises(AssertionError):
+        CaseInsensitiveDict({"key": 1, "KEY": 2})
+
+
+def test_cli_coro():
+    @cli_coro
+    async def coro(value):
+        """A coroutine."""
+
+        await asyncio.sleep(0)
+        return value
+
+    current_loop = asyncio.get_event_loop_policy().get_event_loop()
+
+    assert coro(42) == 42
+    assert coro.__doc__ == "A coroutine."
+
+    # The current event loop is not modified.
+    assert asyncio.get_event_loop_policy().get_event_loop() is current_loop